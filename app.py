@@ -1,10 +1,28 @@
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
 import streamlit as st
 import requests
+import requests_cache
+import numpy as np
+import orjson
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 # --- Dein FRED-Key als Secret in Streamlit hinterlegen ---
 API_KEY = st.secrets["FRED_API_KEY"]
 
+# Feste Parameter jeder FRED-Abfrage
+FRED_URL = "https://api.stlouisfed.org/fred/series/observations"
+FRED_PARAMS = {"api_key": API_KEY, "file_type": "json"}
+
 # --- FRED-Serien für US-Kennzahlen ---
 SERIES = {
     "Interest Rate":         "FEDFUNDS",
@@ -20,56 +38,175 @@ SERIES = {
     "Balance of Trade":      "BOPGSTB"
 }
 
-@st.cache_data(ttl=3600)
-def fetch_fred(series_id: str) -> pd.Series:
-    """Holt eine monatliche Zeitreihe aus FRED."""
-    url = "https://api.stlouisfed.org/fred/series/observations"
-    params = dict(
-        series_id=series_id,
-        api_key=API_KEY,
-        file_type="json"
+# Abgeleitete Nachschlagetabellen zu SERIES
+SERIES_NAMES = tuple(SERIES)
+FRED_IDS = tuple(dict.fromkeys(SERIES.values()))
+
+# Kennzahlen, die als prozentuale Veränderung angezeigt werden: Name -> Perioden
+PCT_CHANGE = {"CPI MoM": 1, "CPI YoY": 12, "Retail Sales MoM": 1}
+PCT_METRICS = frozenset(PCT_CHANGE)
+
+# Gemeinsamer Rückgabewert für "keine Daten"; wird nie verändert
+EMPTY_SERIES = pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+
+# Antworten bleiben 24 h im persistenten HTTP-Cache
+HTTP_CACHE_TTL = timedelta(hours=24)
+
+# Redis-URL für den persistenten HTTP-Cache (optional, benötigt das Paket redis)
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Fehler, an denen ein einzelner Abruf scheitern darf, ohne die Seite mitzureißen:
+# Netzwerk/HTTP sowie das Cache-Backend (SQLite bzw. Redis)
+FETCH_ERRORS = (requests.RequestException, sqlite3.Error)
+if REDIS_URL:
+    from redis import RedisError
+    FETCH_ERRORS += (RedisError,)
+
+# --- Gemeinsame HTTP-Session: Keep-Alive statt neuem TLS-Handshake je Abruf ---
+# Antworten landen zusätzlich im persistenten Cache (Redis wird von allen Replikas
+# geteilt) und überleben so Neustarts; st.cache_data bleibt als schneller
+# In-Memory-Cache darüber. Streamlit führt das Skript bei jedem Rerun neu aus,
+# über cache_resource bleibt die Session samt Verbindungspool bestehen.
+@st.cache_resource(show_spinner=False)
+def _session() -> requests_cache.CachedSession:
+    """HTTP-Session mit persistentem Cache: Redis bei gesetzter REDIS_URL, sonst SQLite."""
+    backend = "sqlite"
+    if REDIS_URL:
+        from redis import Redis
+        # Der Cache ist optional: ist Redis nicht erreichbar, mit SQLite weitermachen
+        try:
+            connection = Redis.from_url(REDIS_URL)
+            connection.ping()
+            # ttl=False: Redis soll abgelaufene Einträge nicht selbst löschen, sonst hat
+            # stale_if_error unten nichts mehr, was es bei einem FRED-Ausfall zeigen kann
+            backend = requests_cache.RedisCache(connection=connection, ttl=False)
+        except RedisError as e:
+            logger.warning("Redis unter REDIS_URL nicht erreichbar (%s), nutze SQLite-Cache", e)
+    session = requests_cache.CachedSession(
+        "macro_cache",
+        backend=backend,
+        expire_after=HTTP_CACHE_TTL,
+        allowable_methods=("GET",),
+        # Ist FRED nicht erreichbar, lieber die letzte (abgelaufene) Antwort zeigen als nichts
+        stale_if_error=True
     )
-    data = requests.get(url, params=params).json().get("observations", [])
+    session.mount("https://", HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3)
+    ))
+    return session
+
+def _safe_float(v) -> float:
+    """Wandelt einen FRED-Wert in float; "." (fehlt) und Unlesbares werden NaN."""
+    # Fehlwerte direkt abfangen, statt für jeden eine Exception zu werfen
+    if v is None or v == ".":
+        return float("nan")
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float("nan")
+
+# show_spinner=False: beide werden aus Worker-Threads ohne Script-Kontext aufgerufen
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _fred_raw(series_id: str, limit: Optional[int] = None) -> list:
+    """Holt die rohen FRED-Beobachtungen (JSON) einer Serie, optional nur die letzten `limit`."""
+    params = {**FRED_PARAMS, "series_id": series_id}
+    if limit:
+        # Neueste zuerst anfordern, damit FRED serverseitig abschneiden kann
+        params["sort_order"] = "desc"
+        params["limit"] = limit
+    resp = _session().get(FRED_URL, params=params, timeout=10)
+    # Fehlerantworten nicht als "keine Daten" cachen: Exceptions merkt sich
+    # st.cache_data nicht, und requests-cache liefert vorher die alte Kopie
+    resp.raise_for_status()
+    data = orjson.loads(resp.content).get("observations", [])
+    # Aufrufer bekommen die Beobachtungen immer aufsteigend nach Datum
+    return data[::-1] if limit else data
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def fetch_fred(series_id: str, limit: Optional[int] = None) -> pd.Series:
+    """Holt eine monatliche Zeitreihe aus FRED."""
+    data = _fred_raw(series_id, limit)
     if not data:
-        return pd.Series(dtype=float)
-    df = pd.DataFrame(data)
-    if not {"date","value"}.issubset(df.columns):
-        return pd.Series(dtype=float)
-    df["date"]  = pd.to_datetime(df["date"], errors="coerce")
-    df["value"] = pd.to_numeric(df["value"], errors="coerce")
-    return df.set_index("date")["value"].sort_index()
-
-def get_series(name: str) -> pd.Series:
-    s = fetch_fred(SERIES[name])
-    if name == "CPI MoM":
-        return s.pct_change(1) * 100
-    if name == "CPI YoY":
-        return s.pct_change(12) * 100
-    if name == "Retail Sales MoM":
-        return s.pct_change(1) * 100
-    return s
+        return EMPTY_SERIES
+    # Nur die beiden benötigten Felder spaltenweise übernehmen, realtime_* verwerfen
+    dates  = [o.get("date") for o in data]
+    index  = pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce")
+    # Werte direkt typisiert einlesen; float64, weil float32 bei Niveaus mit drei
+    # Nachkommastellen (z. B. GDPC1) die zweite angezeigte Stelle verfälscht
+    values = np.fromiter((_safe_float(o.get("value")) for o in data), dtype=np.float64, count=len(data))
+    # FRED liefert die Beobachtungen bereits aufsteigend nach Datum
+    return pd.Series(values, index=index, name="value")
+
+def fetch_fred_batch(series_ids, limit: Optional[int] = None) -> dict:
+    """Holt mehrere FRED-Serien gleichzeitig, jede ID genau einmal; fehlgeschlagene IDs fehlen."""
+    unique_ids = tuple(dict.fromkeys(series_ids))
+
+    def fetch(sid):
+        try:
+            return fetch_fred(sid, limit)
+        except FETCH_ERRORS:
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(unique_ids)) as ex:
+        results = dict(zip(unique_ids, ex.map(fetch, unique_ids)))
+    return {sid: s for sid, s in results.items() if s is not None}
+
+@st.cache_data(ttl=3600, max_entries=32)
+def fred_pct_change(series_id: str, periods: int, limit: Optional[int] = None) -> pd.Series:
+    """Veränderung einer FRED-Serie in Prozent gegenüber `periods` Perioden zuvor."""
+    # Prozentwerte (zwei Nachkommastellen) vertragen float32, anders als Niveaus wie GDPC1
+    return (fetch_fred(series_id, limit).pct_change(periods) * 100).astype("float32")
+
+@st.cache_data(ttl=3600, max_entries=32)
+def get_series(name: str, limit: Optional[int] = None) -> pd.Series:
+    sid = SERIES[name]
+    periods = PCT_CHANGE.get(name)
+    if periods:
+        return fred_pct_change(sid, periods, limit)
+    return fetch_fred(sid, limit)
 
 st.title("US-Macro-Dashboard")
 
 # Nur Tabellen-Ansicht
-metrics = list(SERIES.keys())
+metrics = SERIES_NAMES
 st.subheader("Tabelle der letzten 13 Perioden")
-# Spalten aus erster Kennzahl ziehen
-dates = get_series(metrics[0]).sort_index(ascending=False).index[:13]
-cols = [d.strftime("%b %Y") for d in dates]
-
-table = {}
-for name in metrics:
-    vals = get_series(name).sort_index(ascending=False).head(13).tolist()
-    if name in ("CPI MoM","CPI YoY","Retail Sales MoM"):
-        row = [f"{v:.2f} %" if pd.notna(v) else "" for v in vals]
-    else:
-        row = [f"{v:,.2f}"   if pd.notna(v) else "" for v in vals]
-    table[name] = row
-
-df = pd.DataFrame.from_dict(table, orient="index", columns=cols)
+
+# Die Tabelle braucht nur die jüngsten 13 Perioden plus den längsten
+# Vorlauf für pct_change (12 Monate für CPI YoY)
+limit = 13 + max(PCT_CHANGE.values())
+
+# Alle benötigten Serien parallel vorladen (IO-gebunden); get_series trifft danach
+# den Cache. Fehlgeschlagene Abrufe werden hier nicht noch einmal versucht.
+loaded = fetch_fred_batch(FRED_IDS, limit)
+series_map = {name: get_series(name, limit) for name in metrics if SERIES[name] in loaded}
+
+# Kennzahlen ohne Daten nicht in die Tabelle aufnehmen, aber darunter nennen
+missing = [name for name in metrics if name not in series_map or series_map[name].empty]
+series_map = {name: s for name, s in series_map.items() if not s.empty}
+if not series_map:
+    st.info("Keine Daten verfügbar.")
+    st.stop()
+
+# Alle Kennzahlen nach Datum ausrichten (aufsteigend) und die jüngsten 13 Perioden
+# vom Ende nehmen; Kennzahlen ohne Wert in einer Periode (z. B. GDP je Quartal)
+# bleiben dort leer
+recent = pd.concat(series_map, axis=1, sort=True).iloc[-13:][::-1]
+df = recent.T
+df.columns = recent.index.strftime("%b %Y")
 df.index.name = "Kennzahl"
-st.dataframe(df)
+
+# Formatiert wird erst bei der Anzeige, die Zahlen bleiben dadurch sortierbar
+pct_rows = pd.IndexSlice[df.index[df.index.isin(PCT_METRICS)], :]
+styled = (
+    df.style
+    .format("{:,.2f}", na_rep="")
+    .format("{:.2f} %", na_rep="", subset=pct_rows)
+)
+st.dataframe(styled)
+if missing:
+    st.caption("Keine Daten: " + ", ".join(missing))
 
 st.markdown("""
 ---